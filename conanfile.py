@@ -74,5 +74,6 @@ class GradusConan(ConanFile):
         
         # Инструменты
         bin_path = os.path.join(self.package_folder, "bin")
-        self.output.info(f"Appending PATH environment variable: {bin_path}")
-        self.env_info.PATH.append(bin_path)
+        if os.path.isdir(bin_path) and os.listdir(bin_path):
+            self.output.info(f"Prepending PATH environment variable: {bin_path}")
+            self.runenv_info.prepend_path("PATH", bin_path)
@@ -6,69 +6,226 @@
 
 import os
 import sys
+import argparse
+import functools
+import hashlib
+import json
 import subprocess
 import tempfile
 import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
 from typing import List, Dict, Tuple, Optional
 
+# Сколько последних строк вывода команды хранится в памяти
+OUTPUT_TAIL_LINES = 10000
+# Максимальная длина одной строки; более длинные строки режутся на части
+OUTPUT_LINE_LIMIT = 4096
+# Таймаут выполнения одной команды, секунд
+COMMAND_TIMEOUT = 300  # 5 минут
+
+# Неизменяемые части команд сборки
+GCC_ARGV = ('gcc', '-Wall', '-Wextra', '-std=c99')
+CLANG_ARGV = ('clang', '-Wall', '-Wextra', '-std=c99')
+SOURCE_ARGV = ('gradus_enhanced.c', '-lm')
+CMAKE_CONFIGURE_ARGV = ('cmake', '..', '-DCMAKE_BUILD_TYPE=Release')
+
+# Методы сборки, которые в режиме fail-fast пропускаются, если все
+# запущенные сборки компиляторами (GCC, Clang) завершились ошибкой
+COMPILER_TESTS = ('GCC', 'Clang')
+FAIL_FAST_DEPENDENT = ('Makefile', 'CMake', 'Docker')
+
+# Постоянный buildx-сборщик и локальный кэш слоёв для Docker
+DOCKER_BUILDER = 'gradus-builder'
+DOCKER_CACHE_DIR = Path(tempfile.gettempdir()) / 'gradus-cache'
+# Файлы контекста, от которых зависит образ (см. COPY в Dockerfile);
+# список должен совпадать с разрешёнными файлами в .dockerignore
+DOCKER_CONTEXT_FILES = (
+    'Dockerfile', 'gradus.c', 'CMakeLists.txt', 'Makefile', 'build.sh',
+    'README_ENHANCED.md', 'ENHANCED_FEATURES.md',
+)
+DOCKER_HASH_LABEL = 'gradus-src-hash'
+
+# Инструменты, наличие которых проверяется перед тестами
+TOOLS = ('gcc', 'clang', 'make', 'cmake', 'ninja', 'docker')
+
+
+@functools.lru_cache(maxsize=1)
+def _probe_tools(path_env: str) -> Dict[str, bool]:
+    """Поиск инструментов в PATH (кэшируется по значению PATH)"""
+    return {tool: shutil.which(tool, path=path_env) is not None for tool in TOOLS}
+
+
 class BuildTester:
-    def __init__(self, source_dir: Path, build_dir: Path):
+    def __init__(self, source_dir: Path, build_dir: Path, incremental: bool = False,
+                 fail_fast: bool = False):
         self.source_dir = source_dir
         self.build_dir = build_dir
+        self.incremental = incremental
+        self.fail_fast = fail_fast
+        # Результат check_dependencies, общий для отчёта и выбора инструментов
+        self.deps = None
         self.results = []
+        self.jobs = os.cpu_count() or 1
+        # Кэширующая обёртка компилятора, если установлена
+        self.cc_launcher = shutil.which('ccache') or shutil.which('buildcache')
+        # Исполняемые файлы, получаемые каждым методом сборки
+        self.artifacts = {
+            'gcc': build_dir / 'gcc' / 'gradus_gcc',
+            'clang': build_dir / 'clang' / 'gradus_clang',
+            'make': build_dir / 'make' / 'gradus',
+            'cmake': build_dir / 'cmake_build' / 'gradus',
+            'script': source_dir / 'gradus',
+        }
         
     def run_command(self, cmd: List[str], cwd: Optional[Path] = None, 
-                   capture_output: bool = True) -> Tuple[int, str, str]:
-        """Выполнение команды и возврат результата"""
+                   capture_output: bool = True,
+                   env: Optional[Dict[str, str]] = None,
+                   label: Optional[str] = None) -> Tuple[int, str, str]:
+        """Выполнение команды с потоковым выводом и возврат результата
+        
+        Вывод печатается по мере поступления с префиксом label (по умолчанию
+        имя команды), в памяти хранятся только последние OUTPUT_TAIL_LINES
+        строк длиной не более OUTPUT_LINE_LIMIT символов. stderr объединяется
+        с stdout.
+        """
+        tail = deque(maxlen=OUTPUT_TAIL_LINES)
+        tail_lock = threading.Lock()
+        prefix = f"  [{label or Path(cmd[0]).name}] "
+        
+        def pump(stream):
+            line_start = True
+            for line in iter(lambda: stream.readline(OUTPUT_LINE_LIMIT), ''):
+                # Части длинной строки, разрезанной readline, идут без префикса
+                sys.stdout.write(prefix + line if line_start else line)
+                line_start = line.endswith('\n')
+                if capture_output:
+                    with tail_lock:
+                        tail.append(line)
+            stream.close()
+        
+        def collected() -> str:
+            with tail_lock:
+                return ''.join(list(tail))
+        
         try:
-            result = subprocess.run(
-                cmd, 
+            proc = subprocess.Popen(
+                cmd,
                 cwd=cwd or self.source_dir,
-                capture_output=capture_output,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=1,
                 text=True,
-                timeout=300  # 5 минут таймаут
+                errors='replace'
             )
-            return result.returncode, result.stdout, result.stderr
-        except subprocess.TimeoutExpired:
-            return -1, "", "Command timed out"
         except FileNotFoundError:
             return -1, "", f"Command not found: {cmd[0]}"
         except Exception as e:
             return -1, "", str(e)
+        
+        # Общий срок и для процесса, и для чтения его вывода: потомки
+        # процесса могут держать канал открытым после его завершения
+        deadline = time.monotonic() + COMMAND_TIMEOUT
+        reader = threading.Thread(target=pump, args=(proc.stdout,), daemon=True)
+        reader.start()
+        try:
+            returncode = proc.wait(timeout=COMMAND_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait(5)
+            reader.join(5)
+            return -1, collected(), "Command timed out"
+        reader.join(max(0.0, deadline - time.monotonic()))
+        if reader.is_alive():
+            return -1, collected(), "Command timed out"
+        return returncode, collected(), ""
+    
+    def compiler_command(self, cmd: List[str]) -> List[str]:
+        """Добавление кэширующей обёртки к команде компилятора"""
+        if self.cc_launcher:
+            return [self.cc_launcher] + cmd
+        return cmd
+    
+    def lto_flags(self, compiler: str) -> List[str]:
+        """Флаги оптимизации с параллельным LTO для компилятора
+        
+        Число потоков LTO можно ограничить переменной GRADUS_LTO_JOBS.
+        """
+        lto_jobs = os.environ.get('GRADUS_LTO_JOBS')
+        if compiler == 'clang':
+            flags = ['-O2', '-flto=thin']
+            if lto_jobs:
+                flags.append(f'-flto-jobs={lto_jobs}')
+            return flags
+        return ['-O2', f'-flto={lto_jobs or "auto"}']
+    
+    def work_dir(self, name: str) -> Path:
+        """Отдельная рабочая директория для метода сборки"""
+        path = self.build_dir / name
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+    
+    def docker_context_hash(self) -> str:
+        """Хэш содержимого файлов, из которых собирается Docker-образ"""
+        digest = hashlib.sha256()
+        paths = [self.source_dir / name for name in DOCKER_CONTEXT_FILES]
+        paths.extend(sorted(self.source_dir.glob('*.h')))
+        for path in paths:
+            if path.is_file():
+                digest.update(path.name.encode())
+                digest.update(path.read_bytes())
+        return digest.hexdigest()
+    
+    def docker_image_hash(self) -> Optional[str]:
+        """Хэш исходников, с которым был собран образ gradus-test"""
+        ret, out, _ = self.run_command([
+            'docker', 'image', 'inspect', '--format',
+            f'{{{{index .Config.Labels "{DOCKER_HASH_LABEL}"}}}}', 'gradus-test'
+        ], label='Docker')
+        return out.strip() if ret == 0 else None
+    
+    def ensure_buildx_builder(self) -> bool:
+        """Создание buildx-сборщика, если он ещё не существует"""
+        ret, _, _ = self.run_command(['docker', 'buildx', 'inspect', DOCKER_BUILDER],
+                                     label='Docker')
+        if ret == 0:
+            return True
+        ret, _, _ = self.run_command([
+            'docker', 'buildx', 'create', '--name', DOCKER_BUILDER
+        ], label='Docker')
+        return ret == 0
     
     def check_dependencies(self) -> Dict[str, bool]:
         """Проверка доступности зависимостей"""
-        deps = {
-            'gcc': False,
-            'clang': False,
-            'make': False,
-            'cmake': False,
-            'docker': False,
-        }
-        
-        for tool in deps:
-            ret, _, _ = self.run_command(['which', tool], capture_output=True)
-            deps[tool] = ret == 0
-        
-        return deps
+        return dict(_probe_tools(os.environ.get('PATH', os.defpath)))
+    
+    def has_tool(self, tool: str) -> bool:
+        """Доступность инструмента по результату проверки зависимостей"""
+        if self.deps is None:
+            self.deps = self.check_dependencies()
+        return self.deps[tool]
     
     def test_gcc_build(self) -> Dict[str, any]:
         """Тестирование сборки с GCC"""
         print("🧪 Тестирование сборки с GCC...")
+        work_dir = self.work_dir('gcc')
+        artifact = self.artifacts['gcc']
         
-        ret, out, err = self.run_command([
-            'gcc', '-Wall', '-Wextra', '-std=c99', '-o', 'gradus_gcc', 
-            'gradus_enhanced.c', '-lm'
-        ], cwd=self.build_dir)
+        ret, out, err = self.run_command(self.compiler_command([
+            *GCC_ARGV, *self.lto_flags('gcc'), '-o', str(artifact), *SOURCE_ARGV
+        ]), cwd=work_dir, label='GCC')
         
-        success = ret == 0 and os.path.exists(self.build_dir / 'gradus_gcc')
+        success = ret == 0 and os.access(artifact, os.X_OK)
         
         if success:
             # Тестирование программы
             test_ret, test_out, test_err = self.run_command([
-                './gradus_gcc', '-T'
-            ], cwd=self.build_dir)
+                str(artifact), '-T'
+            ], cwd=work_dir, label='GCC')
             functional = test_ret == 0
         else:
             functional = False
@@ -83,19 +240,20 @@ class BuildTester:
     def test_clang_build(self) -> Dict[str, any]:
         """Тестирование сборки с Clang"""
         print("🧪 Тестирование сборки с Clang...")
+        work_dir = self.work_dir('clang')
+        artifact = self.artifacts['clang']
         
-        ret, out, err = self.run_command([
-            'clang', '-Wall', '-Wextra', '-std=c99', '-o', 'gradus_clang',
-            'gradus_enhanced.c', '-lm'
-        ], cwd=self.build_dir)
+        ret, out, err = self.run_command(self.compiler_command([
+            *CLANG_ARGV, *self.lto_flags('clang'), '-o', str(artifact), *SOURCE_ARGV
+        ]), cwd=work_dir, label='Clang')
         
-        success = ret == 0 and os.path.exists(self.build_dir / 'gradus_clang')
+        success = ret == 0 and os.access(artifact, os.X_OK)
         
         if success:
             # Тестирование программы
             test_ret, test_out, test_err = self.run_command([
-                './gradus_clang', '-T'
-            ], cwd=self.build_dir)
+                str(artifact), '-T'
+            ], cwd=work_dir, label='Clang')
             functional = test_ret == 0
         else:
             functional = False
@@ -111,19 +269,25 @@ class BuildTester:
         """Тестирование сборки через Makefile"""
         print("🧪 Тестирование сборки через Makefile...")
         
-        # Копируем Makefile во временную директорию
-        shutil.copy(self.source_dir / 'Makefile', self.build_dir / 'Makefile')
+        work_dir = self.work_dir('make')
+        # Makefile используется прямо из исходников, без копирования
+        make = ['make', '-C', str(work_dir), '-f', str(self.source_dir / 'Makefile')]
         
-        ret, out, err = self.run_command(['make', 'clean'], cwd=self.build_dir)
-        ret, out, err = self.run_command(['make'], cwd=self.build_dir)
+        # clean запускается отдельно: с -j цели из командной строки
+        # могут выполняться одновременно
+        if not self.incremental:
+            ret, out, err = self.run_command(make + ['clean'], label='Makefile')
+        ret, out, err = self.run_command(make + ['-j', str(self.jobs), 'all'],
+                                         label='Makefile')
         
-        success = ret == 0 and os.path.exists(self.build_dir / 'gradus')
+        artifact = self.artifacts['make']
+        success = ret == 0 and os.access(artifact, os.X_OK)
         
         if success:
             # Тестирование программы
             test_ret, test_out, test_err = self.run_command([
-                './gradus', '-T'
-            ], cwd=self.build_dir)
+                str(artifact), '-T'
+            ], cwd=work_dir, label='Makefile')
             functional = test_ret == 0
         else:
             functional = False
@@ -139,34 +303,46 @@ class BuildTester:
         """Тестирование сборки через CMake"""
         print("🧪 Тестирование сборки через CMake...")
         
-        cmake_build_dir = self.build_dir / 'cmake_build'
-        cmake_build_dir.mkdir(exist_ok=True)
-        
-        # Конфигурация
-        ret, out, err = self.run_command([
-            'cmake', '..', '-DCMAKE_BUILD_TYPE=Release'
-        ], cwd=cmake_build_dir)
-        
-        if ret != 0:
-            return {
-                'success': False,
-                'functional': False,
-                'output': out + err,
-                'test_output': 'CMake configuration failed'
-            }
+        cmake_build_dir = self.work_dir('cmake_build')
+        
+        # Конфигурация (пропускается, если уже есть сгенерированные файлы сборки;
+        # CMakeCache.txt для этого не подходит: он создаётся и при ошибке)
+        configured = any((cmake_build_dir / name).exists()
+                         for name in ('build.ninja', 'Makefile'))
+        if not (self.incremental and configured):
+            # Кэш неудачной конфигурации мог быть создан другим генератором
+            cache = cmake_build_dir / 'CMakeCache.txt'
+            if cache.exists():
+                cache.unlink()
+                shutil.rmtree(cmake_build_dir / 'CMakeFiles', ignore_errors=True)
+            configure = list(CMAKE_CONFIGURE_ARGV)
+            if self.has_tool('ninja'):
+                configure.extend(['-G', 'Ninja'])
+            if self.cc_launcher:
+                configure.append(f'-DCMAKE_C_COMPILER_LAUNCHER={self.cc_launcher}')
+            ret, out, err = self.run_command(configure, cwd=cmake_build_dir, label='CMake')
+            
+            if ret != 0:
+                return {
+                    'success': False,
+                    'functional': False,
+                    'output': out + err,
+                    'test_output': 'CMake configuration failed'
+                }
         
         # Сборка
         ret, out, err = self.run_command([
-            'cmake', '--build', '.', '-j4'
-        ], cwd=cmake_build_dir)
+            'cmake', '--build', '.', '--parallel', str(self.jobs)
+        ], cwd=cmake_build_dir, label='CMake')
         
-        success = ret == 0 and os.path.exists(cmake_build_dir / 'gradus')
+        artifact = self.artifacts['cmake']
+        success = ret == 0 and os.access(artifact, os.X_OK)
         
         if success:
             # Тестирование программы
             test_ret, test_out, test_err = self.run_command([
-                './gradus', '-T'
-            ], cwd=cmake_build_dir)
+                str(artifact), '-T'
+            ], cwd=cmake_build_dir, label='CMake')
             functional = test_ret == 0
         else:
             functional = False
@@ -184,15 +360,16 @@ class BuildTester:
         
         ret, out, err = self.run_command([
             './build.sh', '--verbose'
-        ], cwd=self.source_dir)
+        ], cwd=self.source_dir, label='Build Script')
         
-        success = ret == 0 and os.path.exists(self.source_dir / 'gradus')
+        artifact = self.artifacts['script']
+        success = ret == 0 and os.access(artifact, os.X_OK)
         
         if success:
             # Тестирование программы
             test_ret, test_out, test_err = self.run_command([
-                './gradus', '-T'
-            ], cwd=self.source_dir)
+                str(artifact), '-T'
+            ], cwd=self.source_dir, label='Build Script')
             functional = test_ret == 0
         else:
             functional = False
@@ -208,7 +385,7 @@ class BuildTester:
         """Тестирование Docker сборки"""
         print("🧪 Тестирование Docker сборки...")
         
-        if not shutil.which('docker'):
+        if not self.has_tool('docker'):
             return {
                 'success': False,
                 'functional': False,
@@ -216,9 +393,33 @@ class BuildTester:
                 'test_output': 'Docker not available'
             }
         
-        ret, out, err = self.run_command([
-            'docker', 'build', '-t', 'gradus-test', '.'
-        ], cwd=self.source_dir)
+        ctx_hash = self.docker_context_hash()
+        label = f'{DOCKER_HASH_LABEL}={ctx_hash}'
+        
+        if self.docker_image_hash() == ctx_hash:
+            # Образ собран из тех же исходников, пересборка не нужна
+            ret, out, err = 0, "Image is up to date, build skipped", ""
+        elif self.ensure_buildx_builder():
+            # Постоянный сборщик не тратит время на запуск buildkitd,
+            # а слои кэшируются локально между запусками
+            ret, out, err = self.run_command([
+                'docker', 'buildx', 'build',
+                '--builder', DOCKER_BUILDER, '--load',
+                '--cache-from', f'type=local,src={DOCKER_CACHE_DIR}',
+                '--cache-to', f'type=local,dest={DOCKER_CACHE_DIR},mode=max',
+                '--label', label,
+                '-t', 'gradus-test', '.'
+            ], cwd=self.source_dir, label='Docker')
+        else:
+            # BuildKit с inline-кэшем позволяет переиспользовать слои прошлой сборки
+            ret, out, err = self.run_command([
+                'docker', 'build',
+                '--cache-from', 'gradus-test',
+                '--build-arg', 'BUILDKIT_INLINE_CACHE=1',
+                '--label', label,
+                '-t', 'gradus-test', '.'
+            ], cwd=self.source_dir, env={**os.environ, 'DOCKER_BUILDKIT': '1'},
+               label='Docker')
         
         if ret != 0:
             return {
@@ -231,7 +432,7 @@ class BuildTester:
         # Тестирование образа
         test_ret, test_out, test_err = self.run_command([
             'docker', 'run', '--rm', 'gradus-test', '-T'
-        ])
+        ], label='Docker')
         
         return {
             'success': True,
@@ -247,7 +448,7 @@ class BuildTester:
         
         # Проверка зависимостей
         print("📋 Проверка зависимостей...")
-        deps = self.check_dependencies()
+        deps = self.deps = self.check_dependencies()
         for tool, available in deps.items():
             status = "✓" if available else "✗"
             print(f"  {status} {tool}")
@@ -264,12 +465,54 @@ class BuildTester:
             'Docker': self.test_docker_build if deps['docker'] else None,
         }
         
+        # Методы сборки независимы и большую часть времени ждут дочерние
+        # процессы, поэтому запускаем их параллельно. Проверка собранной
+        # программы (-T) выполняется в том же потоке сразу после сборки,
+        # так что проверки разных методов тоже идут одновременно
+        completed = {}
+        skipped = {}
+        enabled = {name: func for name, func in tests.items() if func}
+        with ThreadPoolExecutor(max_workers=len(enabled)) as pool:
+            deferred = {}
+            if self.fail_fast:
+                deferred = {name: enabled.pop(name)
+                            for name in FAIL_FAST_DEPENDENT if name in enabled}
+            futures = {pool.submit(func): name for name, func in enabled.items()}
+            
+            if deferred:
+                # Зависимые методы запускаются только после сборки компиляторами
+                compilers = [f for f, name in futures.items() if name in COMPILER_TESTS]
+                wait(compilers)
+                if not compilers or any(f.result()['success'] for f in compilers):
+                    futures.update({pool.submit(func): name
+                                    for name, func in deferred.items()})
+                else:
+                    # Перечисляем только компиляторы, которые действительно запускались
+                    failed = [futures[f] for f in compilers]
+                    for name in deferred:
+                        skipped[name] = {
+                            'success': False,
+                            'functional': False,
+                            'output': f"{' and '.join(failed)} build failed",
+                            'test_output': 'Skipped (fail-fast)'
+                        }
+            
+            for future in as_completed(futures):
+                completed[futures[future]] = future.result()
+        
         results = {}
-        for name, test_func in tests.items():
-            if test_func:
+        for name in tests:
+            if name in completed:
+                result = completed[name]
+                print(f"\n{name}:")
+                print("-" * 40)
+                print("  ✓ сборка успешна" if result['success'] else "  ✗ сборка не удалась")
+                results[name] = result
+            elif name in skipped:
                 print(f"\n{name}:")
                 print("-" * 40)
-                results[name] = test_func()
+                print(f"  ⏭  пропущено: {skipped[name]['output']}")
+                results[name] = skipped[name]
             else:
                 results[name] = {
                     'success': False,
@@ -311,6 +554,10 @@ class BuildTester:
         else:
             print("  ✅ Все методы сборки работают корректно!")
         
+        # Машиночитаемые результаты для агрегации в CI
+        with open(self.build_dir / 'results.json', 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, default=str)
+        
         return {
             'total_tests': total_tests,
             'successful_builds': successful_builds,
@@ -320,20 +567,59 @@ class BuildTester:
         }
 
 
+def git_revision(source_dir: Path) -> Optional[str]:
+    """SHA текущего коммита или None, если git недоступен"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=source_dir,
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
 def main():
     """Главная функция"""
+    parser = argparse.ArgumentParser(description="Тестирование сборки программы gradus")
+    parser.add_argument(
+        '--incremental', action='store_true',
+        default=os.environ.get('GRADUS_INCREMENTAL') == '1',
+        help="не очищать директорию сборки и переиспользовать результаты "
+             "предыдущего запуска (также GRADUS_INCREMENTAL=1)"
+    )
+    parser.add_argument(
+        '--fail-fast', action='store_true',
+        help="пропустить сборку через Makefile, CMake и Docker, "
+             "если не удалась ни одна из запущенных сборок GCC и Clang"
+    )
+    args = parser.parse_args()
+    
     # Определение директорий
     source_dir = Path(__file__).parent.absolute()
     build_dir = source_dir / 'test_build'
     
     # Очистка предыдущих тестов
-    if build_dir.exists():
+    if build_dir.exists() and not args.incremental:
         shutil.rmtree(build_dir)
     build_dir.mkdir(exist_ok=True)
     
     # Запуск тестов
-    tester = BuildTester(source_dir, build_dir)
+    tester = BuildTester(source_dir, build_dir, incremental=args.incremental,
+                         fail_fast=args.fail_fast)
+    started = time.monotonic()
     results = tester.run_all_tests()
+    duration = time.monotonic() - started
+    
+    # Краткая сводка, привязанная к коммиту
+    summary = {
+        'git_sha': git_revision(source_dir),
+        'successful_builds': results['successful_builds'],
+        'functional_programs': results['functional_programs'],
+        'total_tests': results['total_tests'],
+        'duration_s': round(duration, 3),
+    }
+    with open(build_dir / 'results-summary.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
     
     # Возврат кода ошибки для CI/CD
     if results['successful_builds'] == 0: